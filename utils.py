@@ -3,15 +3,26 @@ import re
 import json
 import time
 import logging
-from pathlib import Path
+import itertools
+import functools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+from collections.abc import Iterator
 from datetime import datetime, timedelta
 
+import ijson
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from django.db.models import Prefetch
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
 
 from coldfront.core.utils.common import import_from_settings
 from coldfront.core.project.models import Project
+from coldfront.core.resource.models import Resource
 from coldfront.core.allocation.models import (Allocation,
                                             AllocationUser,
                                             AllocationUserStatusChoice)
@@ -19,21 +30,51 @@ from coldfront.core.allocation.models import (Allocation,
 datestr = datetime.today().strftime("%Y%m%d")
 logger = logging.getLogger(__name__)
 logger.propagate = False
-logger.setLevel(logging.DEBUG)
+logger.setLevel(import_from_settings('SFTOCF_LOG_LEVEL', 'DEBUG'))
 filehandler = logging.FileHandler(f'coldfront/plugins/sftocf/data/logs/sfc{datestr}.log', 'w')
 logger.addHandler(filehandler)
 
 
+MISSING_USERS_PATH = './coldfront/plugins/sftocf/data/missing_users.csv'
+
+JSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2
+
+NUM_RE = re.compile(r"\d*\.?\d+")
+
+# query results larger than this many bytes are parsed as they stream in
+STREAM_THRESHOLD = 1024 * 1024
+
 with open("coldfront/plugins/sftocf/servers.json", "r") as myfile:
     svp = json.loads(myfile.read())
 
+def map_volume_servers(servers):
+    """Return a dict of each volume in the servers config and the servers that host it.
+    """
+    vol_servers = defaultdict(list)
+    for srv, config in servers.items():
+        for vol in config['volumes']:
+            vol_servers[vol].append(srv)
+    return dict(vol_servers)
+
+volume_servers = map_volume_servers(svp)
+
+@functools.lru_cache(maxsize=1)
+def get_credentials():
+    """Return the Starfish username and password from settings.
+    """
+    return import_from_settings('SFUSER'), import_from_settings('SFPASS')
+
 def record_process(func):
     """Wrapper function for logging"""
     def call(*args, **kwargs):
         funcdata = "{} {}".format(func.__name__, func.__code__.co_firstlineno)
         logger.debug("\n%s START.", funcdata)
         result = func(*args, **kwargs)
-        logger.debug("%s END. output:\n%s\n", funcdata, result)
+        if logger.isEnabledFor(logging.DEBUG):
+            # summarize long lists instead of logging every entry
+            summary = f"<list len={len(result)}>" \
+                    if isinstance(result, list) and len(result) > 50 else result
+            logger.debug("%s END. output:\n%s\n", funcdata, summary)
         return result
     return call
 
@@ -44,19 +85,20 @@ class StarFishServer:
     def __init__(self, server, url):
         self.name = server
         self.api_url = f"{url}/api/"
+        self.session = generate_session()
         self.token = self.get_auth_token()
         self.headers = generate_headers(self.token)
+        self.session.headers.update(self.headers)
         self.volumes = self.get_volume_names()
 
     @record_process
     def get_auth_token(self):
         """Obtain a token through the auth endpoint.
         """
-        username = import_from_settings('SFUSER')
-        password = import_from_settings('SFPASS')
+        username, password = get_credentials()
         auth_url = self.api_url + "auth/"
         todo = {"username": username, "password": password}
-        response = requests.post(auth_url, json=todo)
+        response = self.session.post(auth_url, json=todo)
         # response.status_code
         response_json = response.json()
         token = response_json["token"]
@@ -69,7 +111,7 @@ class StarFishServer:
         """ Generate a list of the volumes available on the server.
         """
         stor_url = self.api_url + "storage/"
-        response = return_get_json(stor_url, self.headers)
+        response = return_get_json(stor_url, self.session)
         volnames = [i["name"] for i in response["items"]]
         return volnames
 
@@ -85,26 +127,27 @@ class StarFishServer:
         subpaths : list of strings
         """
         getsubpaths_url = self.api_url + "storage/" + volpath
-        request = return_get_json(getsubpaths_url, self.headers)
+        request = return_get_json(getsubpaths_url, self.session)
         pathdicts = request["items"]
         subpaths = [i["Basename"] for i in pathdicts]
         return subpaths
 
-    def create_query(self, query, group_by, volpath, sec=3):
+    def create_query(self, query, group_by, volpath, max_delay=5):
         """Produce a Query class object.
         Parameters
         ----------
         query : string
         group_by : string
         volpath : string
-        sec : integer, optional
+        max_delay : integer, optional
+            maximum number of seconds to wait between checks on the query.
 
         Returns
         -------
         query : Query class object
         """
         query = StarFishQuery(
-            self.headers, self.api_url, query, group_by, volpath, sec=sec
+            self.session, self.api_url, query, group_by, volpath, max_delay=max_delay
         )
         return query
 
@@ -113,7 +156,7 @@ class StarFishServer:
         """Get the membership of the provided volume.
         """
         url = self.api_url + f"mapping/{mtype}_membership?volume_name=" + volume
-        member_list = return_get_json(url, self.headers)
+        member_list = return_get_json(url, self.session)
         return member_list
 
 
@@ -124,22 +167,29 @@ class StarFishQuery:
     Attributes
     ----------
     api_url : str
-    headers : dict
+    session : requests.Session
     query_id : str
-    result : list
+    result : list, or iterator of dicts for large results
 
     Methods
     -------
     post_async_query(query, group_by, volpath)
-    return_results_once_prepared(sec=3)
+    return_results_once_prepared(max_delay=5)
     return_query_result()
+    close()
     """
 
-    def __init__(self, headers, api_url, query, group_by, volpath, sec=3):
+    def __init__(self, session, api_url, query, group_by, volpath, max_delay=5):
         self.api_url = api_url
-        self.headers = headers
+        self.session = session
         self.query_id = self.post_async_query(query, group_by, volpath)
-        self.result = self.return_results_once_prepared(sec=sec)
+        self.result = None
+        try:
+            self.result = self.return_results_once_prepared(max_delay=max_delay)
+        except Exception:
+            # the caller never gets this object, so release the query here
+            self.close()
+            raise
 
     @record_process
     def post_async_query(self, query, group_by, volpath):
@@ -163,29 +213,73 @@ class StarFishQuery:
             "humanize_nested": "false",
             "mount_agent": "None",
         }
-        req = requests.post(query_url, params=params, headers=self.headers)
+        req = self.session.post(query_url, params=params)
         response = req.json()
         logger.debug("response: %s", response)
         return response["query_id"]
 
     @record_process
-    def return_results_once_prepared(self, sec=3):
-        """Wait for posted query to return result.
+    def return_results_once_prepared(self, max_delay=5, max_failures=5):
+        """Wait for posted query to return result, checking quickly at first
+        and backing off toward max_delay seconds between checks. Status checks
+        that time out or fail to connect are retried, up to max_failures in a row.
         """
+        delay = 0.2
+        failures = 0
+        query_check_url = self.api_url + "async/query/" + self.query_id
         while True:
-            query_check_url = self.api_url + "async/query/" + self.query_id
-            response = return_get_json(query_check_url, self.headers)
+            try:
+                response = return_get_json(query_check_url, self.session, timeout=(2, 10))
+                failures = 0
+            except (requests.Timeout, requests.ConnectionError) as err:
+                failures += 1
+                if failures >= max_failures:
+                    raise
+                # a single slow or dropped status check shouldn't end the collection run
+                logger.warning("status check %s for query %s failed, retrying: %s",
+                        failures, self.query_id, err)
+                response = {"is_done": False}
             if response["is_done"] == True:
                 result = self.return_query_result()
                 return result
-            time.sleep(sec)
+            time.sleep(delay)
+            delay = min(delay * 1.5, max_delay)
 
     def return_query_result(self):
-        """Go to link for query result and return the JSON.
+        """Go to link for query result and return the JSON. Large list
+        results are returned as an iterator that parses entries as they arrive.
         """
         query_result_url = self.api_url + "async/query_result/" + self.query_id
-        response = return_get_json(query_result_url, self.headers)
-        return response
+        response = self.session.get(query_result_url, stream=True, timeout=(2, 10))
+        streaming = False
+        try:
+            size = int(response.headers.get("Content-Length", 0))
+            if size and size < STREAM_THRESHOLD:
+                return response.json()
+            response.raw.decode_content = True
+            events = ijson.parse(response.raw, use_float=True)
+            first = next(events)
+            events = itertools.chain([first], events)
+            if first[1] == "start_array":
+                streaming = True
+                return iterate_and_close(ijson.items(events, "item"), response)
+            return next(ijson.items(events, ""))
+        finally:
+            if not streaming:
+                response.close()
+
+    def close(self):
+        """Ask Starfish to discard the query and its result. Failures are
+        logged and otherwise ignored.
+        """
+        # release the connection of a streamed result that wasn't fully read
+        if hasattr(self.result, "close"):
+            self.result.close()
+        query_url = self.api_url + "async/query/" + self.query_id
+        try:
+            self.session.delete(query_url, timeout=(2, 10)).raise_for_status()
+        except requests.RequestException as err:
+            logger.warning("could not delete starfish query %s: %s", self.query_id, err)
 
 
 class ColdFrontDB:
@@ -197,10 +291,10 @@ class ColdFrontDB:
     Methods
     -------
     produce_lab_dict(self, vol)
-    check_volume_collection(self, lr, homepath="./coldfront/plugins/sftocf/data/")
+    check_volume_collection(self, lr, dates, homepath="./coldfront/plugins/sftocf/data/")
     pull_sf(self, volume=None)
     push_cf(self, filepaths, clean)
-    update_usage(self, user, userdict, allocation)
+    update_usage(self, users, userdicts, allocation, active_status)
     """
 
     @record_process
@@ -216,22 +310,20 @@ class ColdFrontDB:
             Structured as follows:
             "lab_name": [("volume", "tier"),("volume", "tier")]
         """
-        pr_objs = Allocation.objects.only("id", "project")
-        pr_dict = {}
+        # load projects and resources up front rather than once per allocation
+        pr_objs = Allocation.objects.select_related("project")\
+                .prefetch_related(Prefetch("resources", queryset=Resource.objects.only("id", "name")))\
+                .only("id", "project__title")
+        pr_dict = defaultdict(list)
         for alloc in pr_objs:
-            proj_name = alloc.project.title
-            resource_list = alloc.get_resources_as_string.split(', ')
-            if proj_name not in pr_dict:
-                pr_dict[proj_name] = resource_list
-            else:
-                pr_dict[proj_name].extend(resource_list)
+            pr_dict[alloc.project.title].extend(r.name for r in alloc.resources.all())
         lab_res = pr_dict if not vol else {p:[i for i in r if vol in i] for p, r in pr_dict.items()}
         labs_resources = {p:[tuple(rs.split("/")) for rs in r] for p, r in lab_res.items()}
         logger.debug("labs_resources:\n%s", labs_resources)
         return labs_resources
 
 
-    def check_volume_collection(self, lr, homepath="./coldfront/plugins/sftocf/data/"):
+    def check_volume_collection(self, lr, dates, homepath="./coldfront/plugins/sftocf/data/"):
         '''
         for each lab-resource combination in parameter lr, check existence of corresponding
         file in data path. If a file for that lab-resource combination that is <2 days old
@@ -241,6 +333,8 @@ class ColdFrontDB:
         ----------
         lr : dict
             Keys are labnames, values are a list of (volume, tier) tuples.
+        dates : list
+            Date strings (YYYYMMDD) of acceptable files, oldest first.
 
         Returns
         -------
@@ -254,20 +348,20 @@ class ColdFrontDB:
         labs_resources = [(l, res[0], res[1]) for l, r in lr.items() for res in r]
         logger.debug("labs_resources:%s", labs_resources)
 
-        yesterdaystr = (datetime.today()-timedelta(1)).strftime("%Y%m%d")
-        dates = [yesterdaystr, datestr]
+        # list the directory once instead of checking each candidate path
+        existing_files = set(os.listdir(homepath)) if os.path.isdir(homepath) else set()
 
         for lr_pair in labs_resources:
             lab = lr_pair[0]
             resource = lr_pair[1]
             tier = lr_pair[2]
-            fpaths = [f"{homepath}{lab}_{resource}_{n}.json" for n in dates]
-            if any(Path(fpath).exists() for fpath in fpaths):
-                for fpath in fpaths:
-                    if Path(fpath).exists():
-                        filepaths.append(fpath)
+            prefix = f"{lab}_{resource}_"
+            fnames = [f"{prefix}{n}.json" for n in dates]
+            found = [f"{homepath}{f}" for f in fnames if f in existing_files]
+            if found:
+                filepaths.extend(found)
             else:
-                to_collect.append((lab, resource, tier, fpaths[-1],))
+                to_collect.append((lab, resource, tier, f"{homepath}{fnames[-1]}",))
 
         return filepaths, to_collect
 
@@ -279,10 +373,21 @@ class ColdFrontDB:
         # 1. produce dict of all labs to be collected & volumes on which their data is located
         lab_res = self.produce_lab_dict(volume)
         # 2. produce list of files collected & list of lab/volume/filename tuples to collect
-        filepaths, to_collect = self.check_volume_collection(lab_res)
+        today = datetime.today()
+        todaystr = today.strftime("%Y%m%d")
+        yesterdaystr = (today - timedelta(1)).strftime("%Y%m%d")
+        filepaths, to_collect = self.check_volume_collection(lab_res, [yesterdaystr, todaystr])
         # 3. produce set of all volumes to be queried
         vol_set = {i[1] for i in to_collect}
-        servers_vols = [(k, vol) for k, v in svp.items() for vol in vol_set if vol in v['volumes']]
+        servers_vols = []
+        for vol in vol_set:
+            vol_servers = volume_servers.get(vol)
+            if not vol_servers:
+                continue
+            if len(vol_servers) > 1:
+                logger.warning("WARNING: volume %s is listed for multiple servers (%s). "
+                        "Collecting from %s.", vol, vol_servers, vol_servers[0])
+            servers_vols.append((vol_servers[0], vol))
         for server_vol in servers_vols:
             srv = server_vol[0]
             vol = server_vol[1]
@@ -290,7 +395,7 @@ class ColdFrontDB:
             to_collect_subset = [t for t in to_collect if t[1] == vol]
             logger.debug("vol: %s\nto_collect_subset: %s", vol, to_collect_subset)
             server = StarFishServer(srv, svp[srv]['url'])
-            fpaths = collect_starfish_usage(server, vol, paths, to_collect_subset)
+            fpaths = collect_starfish_usage(server, vol, paths, to_collect_subset, todaystr)
             filepaths.extend(fpaths)
         return set(filepaths)
 
@@ -300,107 +405,174 @@ class ColdFrontDB:
         Iterate through JSON files in the filepaths list and insert the data
         into the database.
         """
-        for file in filepaths:
-            content = read_json(file)
-            usernames = [d['username'] for d in content['contents']]
-            resource = content['volume'] + "/" + content['tier']
-
-            user_models = get_user_model().objects.only("id","username")\
-                    .filter(username__in=usernames)
-            log_missing_user_models(content["project"], user_models, usernames)
-
-            project = Project.objects.get(title=content["project"])
-            # find project allocation
-            allocations = Allocation.objects.filter(project=project, resources__name=resource)
-            if Allocation.MultipleObjectsReturned.count() > 1:
-                logger.warning(' '.join(["WARNING: Multiple allocations found"
-                        "for project id %s, resource %s. Updating the first."]),
-                        project.id, resource)
-            allocation = allocations.first()
-            logger.debug("%s\nusernames: %s\nuser_models: %s",
-                    project.title, usernames, [u.username for u in user_models])
-
-            for user in user_models:
-                userdict = [d for d in content['contents'] if d["username"] == user.username][0]
-                model = user_models.get(username=userdict["username"])
-                self.update_usage(model, userdict, allocation)
-            if clean:
-                os.remove(file)
+        missing_user_lines = []
+        active_status = AllocationUserStatusChoice.objects.get(name='Active')
+        try:
+            for file in filepaths:
+                content = read_json(file)
+                userdicts = {d['username']: d for d in content['contents']}
+                usernames = list(userdicts)
+                resource = content['volume'] + "/" + content['tier']
+
+                user_models = list(get_user_model().objects.only("id","username")\
+                        .filter(username__in=usernames))
+                missing_user_lines.extend(
+                    log_missing_user_models(content["project"], user_models, usernames))
+
+                project = Project.objects.get(title=content["project"])
+                # find project allocation
+                allocations = list(Allocation.objects.filter(
+                        project=project, resources__name=resource).select_related('project')[:2])
+                if not allocations:
+                    logger.warning("WARNING: No allocation found for project id %s, "
+                            "resource %s. Skipping %s.", project.id, resource, file)
+                    continue
+                if len(allocations) > 1:
+                    logger.warning("WARNING: Multiple allocations found for project id %s, "
+                            "resource %s. Updating the first.", project.id, resource)
+                allocation = allocations[0]
+                logger.debug("%s\nusernames: %s\nuser_models: %s",
+                        project.title, usernames, [u.username for u in user_models])
+
+                self.update_usage(user_models, userdicts, allocation, active_status)
+                if clean:
+                    os.remove(file)
+        finally:
+            # record missing users found so far even if a file fails
+            if missing_user_lines:
+                write_update_file_line(MISSING_USERS_PATH, missing_user_lines)
         logger.debug("push_cf complete")
 
 
-    def update_usage(self, user, userdict, allocation):
-        """Update usage, unit, and usage_bytes values for the designated user.
+    def update_usage(self, users, userdicts, allocation, active_status):
+        """Update usage, unit, and usage_bytes values for the designated users.
+        Parameters
+        ----------
+        users : list of User objects
+        userdicts : dict
+            Starfish usage entries, keyed by username.
+        allocation : Allocation object
+        active_status : AllocationUserStatusChoice object
+            status given to newly created AllocationUsers.
         """
-        usage, unit = split_num_string(userdict["size_sum_hum"])
-        logger.debug("entering for user: %s", user.username)
-        try:
-            allocationuser = AllocationUser.objects.get(
-                allocation=allocation, user=user
-            )
-        except AllocationUser.DoesNotExist:
-            logger.info("creating allocation user:")
-            AllocationUser.objects.create(
-                allocation=allocation,
-                created=timezone.now(),
-                status=AllocationUserStatusChoice.objects.get(name='Active'),
-                user=user
-            )
-            allocationuser = AllocationUser.objects.get(
-                allocation=allocation, user=user
-            )
-
-        allocationuser.usage_bytes = userdict["size_sum"]
-        allocationuser.usage = usage
-        allocationuser.unit = unit
-        # automatically updates "modified" field & adds old record to history
-        allocationuser.save()
-        logger.debug("successful entry: %s, %s", userdict['groupname'], userdict['username'])
+        existing = {au.user_id: au for au in
+                allocation.allocationuser_set.filter(user__in=users)}
+        new_allocationusers = []
+        updated_allocationusers = []
+        now = timezone.now()
+        for user in users:
+            userdict = userdicts[user.username]
+            usage, unit = split_num_string(userdict["size_sum_hum"])
+            logger.debug("entering for user: %s", user.username)
+            allocationuser = existing.get(user.id)
+            if allocationuser is None:
+                logger.info("creating allocation user: %s", user.username)
+                allocationuser = AllocationUser(
+                    allocation=allocation,
+                    created=now,
+                    status=active_status,
+                    user=user
+                )
+                new_allocationusers.append(allocationuser)
+            else:
+                # bulk_update bypasses save(), so "modified" must be set here
+                allocationuser.modified = now
+                updated_allocationusers.append(allocationuser)
+            allocationuser.usage_bytes = userdict["size_sum"]
+            allocationuser.usage = usage
+            allocationuser.unit = unit
+
+        # the *_with_history helpers add the history records that save() would
+        bulk_create_with_history(new_allocationusers, AllocationUser, ignore_conflicts=True)
+        bulk_update_with_history(updated_allocationusers, AllocationUser,
+                ['usage_bytes', 'usage', 'unit', 'modified'])
+        logger.debug("successful entry: %s, %s", allocation.project.title,
+                [u.username for u in users])
 
 
 
 def clean_data_dir(homepath):
     """Remove json from data folder that's more than a week old
     """
-    files = os.listdir(homepath)
-    json_files = [f for f in files if ".json" in f]
-    fpaths = [f"{homepath}{f}" for f in json_files]
-    now = time.time()
-    for fpath in fpaths:
-        created = os.stat(fpath).st_ctime
-        if created < now - 7 * 86400:
-            os.remove(fpath)
+    cutoff = time.time() - 7 * 86400
+    # compute the cutoff once; on Linux entry.stat() is still one stat call per file
+    with os.scandir(homepath) as entries:
+        for entry in entries:
+            if ".json" in entry.name and entry.stat().st_ctime < cutoff:
+                os.remove(entry.path)
 
 def write_update_file_line(filepath, patterns):
+    """Append each pattern to the file as a line unless the line is already present.
+    """
     with open(filepath, 'a+') as file:
         file.seek(0)
-        for pattern in patterns:
-            if not any(pattern == line.rstrip('\r\n') for line in file):
-                file.write(pattern + '\n')
+        existing = {line.rstrip('\r\n') for line in file}
+        new_patterns = [p for p in dict.fromkeys(patterns) if p not in existing]
+        # writes in append mode always go to the end of the file
+        file.writelines(f"{p}\n" for p in new_patterns)
 
 def split_num_string(string):
-    num = re.search(r"\d*\.?\d+", string).group()
+    num = NUM_RE.search(string).group()
     size = string.replace(num, "")
     return num, size
 
-def return_get_json(url, headers):
-    """return JSON from the designated url using the designated headers.
+def return_get_json(url, session, timeout=None):
+    """return JSON from the designated url using the designated session.
     """
-    response = requests.get(url, headers=headers)
+    response = session.get(url, timeout=timeout)
     return response.json()
 
 def save_json(file, contents):
     """save contents to designated file as JSON.
     """
-    with open(file, "w") as writefile:
-        json.dump(contents, writefile, sort_keys=True, indent=4)
+    with open(file, "wb") as writefile:
+        writefile.write(orjson.dumps(contents, option=JSON_OPTIONS))
+
+def save_record_json(file, record, contents):
+    """save record to designated file as JSON, writing the contents entries
+    one at a time so that they never need to be held in memory together.
+    The output matches save_json(file, {**record, "contents": list(contents)}).
+    The file only appears once it is complete, so an interrupted download
+    never leaves a partial file that would be mistaken for a collected one.
+    """
+    fd, tmppath = tempfile.mkstemp(
+        dir=os.path.dirname(file) or ".", prefix=os.path.basename(file), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as writefile:
+            writefile.write(b'{\n  "contents": [')
+            separator = b"\n    "
+            for entry in contents:
+                entry_json = orjson.dumps(entry, option=JSON_OPTIONS).replace(b"\n", b"\n    ")
+                writefile.write(separator + entry_json)
+                separator = b",\n    "
+            writefile.write(b"]" if separator == b"\n    " else b"\n  ]")
+            for key, value in sorted(record.items()):
+                value_json = orjson.dumps(value, option=JSON_OPTIONS).replace(b"\n", b"\n  ")
+                writefile.write(b",\n  " + orjson.dumps(key) + b": " + value_json)
+            writefile.write(b"\n}")
+        # mkstemp creates the file readable only by its owner
+        os.chmod(tmppath, 0o644)
+        os.replace(tmppath, file)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+def iterate_and_close(items, response):
+    """Yield from items, closing response once they are used up, an error
+    is raised, or the iteration is abandoned.
+    """
+    try:
+        yield from items
+    finally:
+        response.close()
 
 def read_json(filepath):
     """from the designated JSON filepath, return the contents.
     """
     logger.debug("read_json for %s", filepath)
-    with open(filepath, "r") as json_file:
-        data = json.loads(json_file.read())
+    with open(filepath, "rb") as json_file:
+        data = orjson.loads(json_file.read())
     return data
 
 def locate_or_create_dirpath(dpath):
@@ -410,8 +582,60 @@ def locate_or_create_dirpath(dpath):
         os.makedirs(dpath)
         logger.info("created new directory %s", dpath)
 
+def collect_project_usage(server, volume, volumepath, project, datestr):
+    """Query Starfish for one project's usage and save the result as JSON.
+    Parameters
+    ----------
+    server : object
+    volume : string
+    volumepath : list of strings
+    project : tuple
+    datestr : string
+
+    Returns
+    -------
+    filepath : string, or None if no usable result was returned
+    """
+    p = project[0]
+    tier = project[2]
+    filepath = project[3]
+    lab_volpath = volumepath[1] if "_l3" in p else volumepath[0]
+    logger.debug("filepath: %s lab: %s volpath: %s", filepath, p, lab_volpath)
+    usage_query = server.create_query(
+        f"type=f groupname={p}", "username, groupname", f"{volume}:{lab_volpath}"
+    )
+    try:
+        data = usage_query.result
+        logger.debug("usage_query.result: %s", data)
+        if not data:
+            logger.warning("No starfish result for lab %s", p)
+            return None
+        if not isinstance(data, (list, Iterator)):
+            logger.warning("Error in starfish result for lab %s:\n%s", p, data)
+            return None
+        record = {
+            "server": server.name,
+            "volume": volume,
+            "path": lab_volpath,
+            "project": p,
+            "tier": tier,
+            "date": datestr,
+        }
+        if isinstance(data, list):
+            save_json(filepath, {**record, "contents": data})
+            return filepath
+        # streamed result: check for entries without reading past the first
+        first = next(data, None)
+        if first is None:
+            logger.warning("No starfish result for lab %s", p)
+            return None
+        save_record_json(filepath, record, itertools.chain([first], data))
+        return filepath
+    finally:
+        usage_query.close()
+
 @record_process
-def collect_starfish_usage(server, volume, volumepath, projects):
+def collect_starfish_usage(server, volume, volumepath, projects, datestr, max_workers=8):
     """
     Parameters
     ----------
@@ -419,56 +643,49 @@ def collect_starfish_usage(server, volume, volumepath, projects):
     volume : string
     volumepath : list of strings
     projects : list of tuples
+    datestr : string
+        date (YYYYMMDD) recorded in the saved files.
+    max_workers : integer, optional
+        number of Starfish queries to run at once.
 
     Returns
     -------
     filepaths : list of strings
     """
     filepaths = []
-    datestr = datetime.today().strftime("%Y%m%d")
     locate_or_create_dirpath("./coldfront/plugins/sftocf/data/")
     logger.debug("projects: %s", projects)
-    for project in projects:
-        p = project[0]
-        tier = project[2]
-        filepath = project[3]
-        lab_volpath = volumepath[1] if "_l3" in p else volumepath[0]
-        logger.debug("filepath: %s lab: %s volpath: %s", filepath, p, lab_volpath)
-        usage_query = server.create_query(
-            f"type=f groupname={p}", "username, groupname", f"{volume}:{lab_volpath}"
-        )
-        data = usage_query.result
-        logger.debug("usage_query.result: %s", data)
-        if not data:
-            logger.warning("No starfish result for lab %s", p)
-        elif isinstance(data, dict) and "error" in data:
-            logger.warning("Error in starfish result for lab %s:\n%s", p, data)
-        else:
-            data = usage_query.result
-            logger.debug(data)
-            record = {
-                "server": server.name,
-                "volume": volume,
-                "path": lab_volpath,
-                "project": p,
-                "tier": tier,
-                "date": datestr,
-                "contents": data,
-            }
-            save_json(filepath, record)
-            filepaths.append(filepath)
+    # queries spend nearly all their time waiting on Starfish, so run them concurrently
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(collect_project_usage, server, volume, volumepath, project, datestr)
+            for project in projects
+        ]
+        for future in as_completed(futures):
+            filepath = future.result()
+            if filepath:
+                filepaths.append(filepath)
     return filepaths
 
 
 def log_missing_user_models(groupname, user_models, usernames):
-    """Identify and record any usernames that lack a matching user_models entry.
+    """Identify and log any usernames that lack a matching user_models entry.
+    Return the corresponding lines for the missing users file.
     """
-    missing_unames = [u for u in usernames if u not in [m.username for m in user_models]]
+    present_unames = {m.username for m in user_models}
+    missing_unames = [u for u in usernames if u not in present_unames]
     if missing_unames:
-        fpath = './coldfront/plugins/sftocf/data/missing_users.csv'
-        patterns = [f"{groupname},{uname},{datestr}" for uname in missing_unames]
-        write_update_file_line(fpath, patterns)
         logger.warning("no User entry found for users: %s", missing_unames)
+    return [f"{groupname},{uname},{datestr}" for uname in missing_unames]
+
+
+def generate_session():
+    """Create a requests Session that keeps connections to the server open
+    between API calls.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
 
 
 def generate_headers(token):